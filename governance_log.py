@@ -0,0 +1,12 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+
+# Append-only audit log shared by the App (writer) and Gem Explorer (reader) pages.
+# Anchored to the app directory rather than the server's working directory.
+GOV_LOG_DIR = Path(__file__).resolve().parent / ".gov_logs"
+
+def append_gov_logs(records):
+    """Appends audit records to the on-disk Parquet log, partitioned by project and workbook."""
+    if records:
+        pq.write_to_dataset(pa.Table.from_pylist(records), root_path=str(GOV_LOG_DIR), partition_cols=["Project", "Workbook"])
@@ -1,13 +1,20 @@
 import streamlit as st
 import pandas as pd
 import json
-import io
-import time
+import asyncio
+import hashlib
+import tempfile
+import threading
+import httplib2
+from concurrent.futures import ThreadPoolExecutor
 from snowflake.snowpark import Session
+from snowflake.snowpark.functions import col, lit
 from googleapiclient.discovery import build
 from google.oauth2 import service_account
-from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.http import HttpRequest, MediaIoBaseUpload
+from google_auth_httplib2 import AuthorizedHttp
 import google.generativeai as genai
+from governance_log import append_gov_logs
 
 # --- 1. CORE HELPERS & DYNAMIC AUTH ---
 def initialize_snowflake(creds):
@@ -18,6 +25,20 @@ def initialize_snowflake(creds):
         st.error(f"Snowflake Auth Failed: {e}")
         return None
 
+QUERY_HISTORY_SQL = (
+    "SELECT QUERY_TAG, QUERY_ID FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY()) "
+    "WHERE QUERY_TAG IN ({placeholders}) AND EXECUTION_STATUS = 'SUCCESS' "
+    "QUALIFY ROW_NUMBER() OVER (PARTITION BY QUERY_TAG ORDER BY START_TIME DESC) = 1"
+)
+RESULT_SCAN_SQL = "SELECT * FROM TABLE(RESULT_SCAN(?))"
+
+def latest_query_ids(sf_session, tags):
+    """Maps each query tag to its latest successful query ID with one QUERY_HISTORY scan."""
+    if not tags: return {}
+    placeholders = ", ".join(["?"] * len(tags))
+    rows = sf_session.sql(QUERY_HISTORY_SQL.format(placeholders=placeholders), params=list(tags)).collect()
+    return {r['QUERY_TAG']: r['QUERY_ID'] for r in rows}
+
 def initialize_google_drive(key_info):
     """Initializes Google Drive API using provided Service Account JSON."""
     try:
@@ -25,7 +46,15 @@ def initialize_google_drive(key_info):
             key_info, 
             scopes=['https://www.googleapis.com/auth/drive.file']
         )
-        return build('drive', 'v3', credentials=creds)
+        # httplib2 is not thread-safe, so each thread keeps its own keep-alive transport
+        local = threading.local()
+        def thread_http():
+            if not hasattr(local, 'http'):
+                local.http = AuthorizedHttp(creds, http=httplib2.Http())
+            return local.http
+        def build_request(http, *args, **kwargs):
+            return HttpRequest(thread_http(), *args, **kwargs)
+        return build('drive', 'v3', http=thread_http(), requestBuilder=build_request)
     except Exception as e:
         st.error(f"Google Drive Auth Failed: {e}")
         return None
@@ -39,35 +68,212 @@ def initialize_gemini(api_key):
         st.error(f"Gemini Configuration Failed: {e}")
         return None
 
-def get_or_create_folder(service, folder_name, parent_id=None):
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+FOLDER_QUERY_FILTER = f" and mimeType = '{FOLDER_MIME}' and trashed = false"
+FOLDER_LIST_FIELDS = "nextPageToken, files(id, name, parents)"  # Only what the sensor reads back
+DRIVE_PARENTS_PER_QUERY = 50  # Keeps the OR-joined `in parents` clause under Drive's query limits
+DRIVE_NAMES_PER_QUERY = 50    # Same cap for the OR-joined `name =` clause
+DRIVE_QUERY_MAX_CHARS = 4000  # Leaves URL headroom once `q` is percent-encoded
+DRIVE_BATCH_LIMIT = 100       # Drive caps a batch HTTP request at 100 calls
+
+def _drive_literal(value):
+    """Escapes a value for use inside a quoted Drive query string."""
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+def _name_clause(folder_name):
+    """One OR-joined `name =` term, as it adds to the query length."""
+    return f" or name = '{_drive_literal(folder_name)}'"
+
+def _parent_clause(parent_id):
+    """One OR-joined `in parents` term, as it adds to the query length."""
+    return f" or '{parent_id}' in parents"
+
+def _folder_query_chunks(pairs):
+    """Splits (parent_id, name) pairs into groups whose OR-joined list query stays within Drive's limits."""
+    chunk, parents, names, size = [], set(), set(), len(FOLDER_QUERY_FILTER)
+    for parent_id, folder_name in pairs:
+        cost = (0 if parent_id in parents else len(_parent_clause(parent_id))) \
+            + (0 if folder_name in names else len(_name_clause(folder_name)))
+        new_parents = len(parents) + (parent_id not in parents)
+        new_names = len(names) + (folder_name not in names)
+        if chunk and (new_parents > DRIVE_PARENTS_PER_QUERY or new_names > DRIVE_NAMES_PER_QUERY
+                      or size + cost > DRIVE_QUERY_MAX_CHARS):
+            yield chunk
+            chunk, parents, names, size = [], set(), set(), len(FOLDER_QUERY_FILTER)
+            cost = len(_parent_clause(parent_id)) + len(_name_clause(folder_name))
+        chunk.append((parent_id, folder_name))
+        parents.add(parent_id)
+        names.add(folder_name)
+        size += cost
+    if chunk: yield chunk
+
+def get_or_create_folders(service, pairs, folder_cache=None):
+    """Batched Folder Sensor: resolves a whole tree level of (parent_id, name) pairs at once.
+
+    Existing folders are found with OR-joined list queries of at most 50 parents,
+    50 names and DRIVE_QUERY_MAX_CHARS characters each. Missing ones are created
+    through batch HTTP requests of up to DRIVE_BATCH_LIMIT calls. Pairs already in
+    `folder_cache` ({(parent_id, name): folder_id}) skip Drive entirely, and every
+    folder seen or created is added to it.
+    """
+    folder_cache = {} if folder_cache is None else folder_cache
+    found = {pair: (folder_cache[pair], "EXISTS") for pair in pairs if pair in folder_cache}
+    pairs = [pair for pair in dict.fromkeys(pairs) if pair not in found]
+    for chunk in _folder_query_chunks(pairs):
+        wanted = set(chunk)
+        names = dict.fromkeys(n for _, n in chunk)
+        parents = list(dict.fromkeys(p for p, _ in chunk))
+        query = "(" + " or ".join(f"name = '{_drive_literal(n)}'" for n in names) + ")"
+        query += FOLDER_QUERY_FILTER
+        parent_ids = [p for p in parents if p]
+        if len(parent_ids) == len(parents):
+            query += " and (" + " or ".join(f"'{p}' in parents" for p in parent_ids) + ")"
+        page_token = None
+        while True:
+            results = service.files().list(
+                q=query, fields=FOLDER_LIST_FIELDS, spaces='drive',
+                pageSize=1000, pageToken=page_token
+            ).execute()
+            for f in results.get('files', []):
+                for p in f.get('parents', []):
+                    folder_cache.setdefault((p, f['name']), f['id'])
+                for p in f.get('parents', []) + [None]:
+                    if (p, f['name']) in wanted and (p, f['name']) not in found:
+                        found[(p, f['name'])] = (f['id'], "EXISTS")
+            page_token = results.get('nextPageToken')
+            if not page_token: break
+
+    missing = [pair for pair in pairs if pair not in found]
+    for i in range(0, len(missing), DRIVE_BATCH_LIMIT):
+        chunk = missing[i:i + DRIVE_BATCH_LIMIT]
+        def on_created(request_id, response, exception, chunk=chunk):
+            if exception: raise exception
+            found[chunk[int(request_id)]] = (response['id'], "CREATED")
+            folder_cache[chunk[int(request_id)]] = response['id']
+        batch = service.new_batch_http_request(callback=on_created)
+        for j, (parent_id, folder_name) in enumerate(chunk):
+            meta = {'name': folder_name, 'mimeType': FOLDER_MIME, 'parents': [parent_id] if parent_id else []}
+            batch.add(service.files().create(body=meta, fields='id'), request_id=str(j))
+        batch.execute()
+    return found
+
+def get_or_create_folder(service, folder_name, parent_id=None, folder_cache=None):
     """Airflow Folder Sensor: Verifies if path exists or creates it."""
-    query = f"name = '{folder_name}' and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-    if parent_id: query += f" and '{parent_id}' in parents"
-    results = service.files().list(q=query, fields="files(id)").execute()
-    files = results.get('files', [])
-    if files: return files[0]['id'], "EXISTS"
-    meta = {'name': folder_name, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [parent_id] if parent_id else []}
-    return service.files().create(body=meta, fields='id').execute().get('id'), "CREATED"
+    if folder_cache and (parent_id, folder_name) in folder_cache:
+        return folder_cache[(parent_id, folder_name)], "EXISTS"
+    return get_or_create_folders(service, [(parent_id, folder_name)], folder_cache)[(parent_id, folder_name)]
 
 # --- 2. GEMINI RETRY SENSOR ---
-def gemini_sensor_with_retry(model, tag_name, project_path, max_retries=3):
-    """Retries Gemini knowledge verification with backoff."""
+async def gemini_sensor_with_retry(model, tag_name, project_path, log, max_retries=3):
+    """Retries Gemini knowledge verification with non-blocking backoff, appending progress to `log`."""
     for attempt in range(1, max_retries + 1):
-        st.write(f"&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;🔄 **Task 3 Attempt {attempt}/{max_retries}:** Verifying index...")
+        log.append(f"{SUB_INDENT}🔄 **Task 3 Attempt {attempt}/{max_retries}:** Verifying index...")
         try:
             # Real Gemini Call (Simulated check logic based on prompt)
-            # response = model.generate_content(f"Can you see the {tag_name} data in {project_path}?")
-            time.sleep(5) # Simulation of AI indexing delay
+            # response = await model.generate_content_async(f"Can you see the {tag_name} data in {project_path}?")
+            await asyncio.sleep(5) # Simulation of AI indexing delay
             return True, "Data successfully indexed in Gemini Knowledge Base."
-        except:
-            if attempt < max_retries: time.sleep(10)
+        except Exception:
+            if attempt < max_retries: await asyncio.sleep(10)
     return False, "Gemini failed to sync data after multiple attempts."
 
-# --- 3. UI LAYOUT ---
+# --- 3. SHEET TASKS (ASYNC FAN-OUT) ---
+DAG_MAX_WORKERS = 8
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # Resumable upload chunk sent per request
+SPOOL_MAX_BYTES = 32 * 1024 * 1024   # Larger exports spill from RAM to a temp file
+JSON_CHUNK_ROWS = 10_000
+DEBUG_PRETTY_JSON = False            # Indented output is for manual inspection only
+
+def write_json_records(frames, fh, chunk_rows=JSON_CHUNK_ROWS):
+    """Writes an iterable of DataFrames to binary `fh` as one JSON array of records."""
+    if DEBUG_PRETTY_JSON:
+        frames = list(frames)
+        df = pd.concat(frames) if frames else pd.DataFrame()
+        fh.write(df.to_json(orient='records', indent=2).encode())
+        return
+    fh.write(b"[")
+    first = True
+    for df in frames:
+        for start in range(0, len(df), chunk_rows):
+            if not first: fh.write(b",")
+            fh.write(df.iloc[start:start + chunk_rows].to_json(orient='records')[1:-1].encode())
+            first = False
+    fh.write(b"]")
+
+def extract_and_upload(sheet, query_id, db, db_id, sf_session, drive_service):
+    """Task 2: pulls the masked sheet result from Snowflake and uploads it to Drive (blocking)."""
+    masked = sf_session.sql(RESULT_SCAN_SQL, params=[query_id])
+    # Masking is projected in Snowflake so PII never leaves the warehouse.
+    # Results without masked columns stay a plain SELECT *, which tolerates duplicate column names.
+    mask_cols = set(db.get('mask_columns', []))
+    if any(c.strip('"') in mask_cols for c in masked.columns):
+        masked = masked.select([
+            lit("***").as_(c) if c.strip('"') in mask_cols else col(c) for c in masked.columns
+        ])
+
+    # Export: stream Arrow result batches straight into the JSON buffer
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as buf:
+        write_json_records(masked.to_pandas_batches(), buf)
+        buf.seek(0)
+        media = MediaIoBaseUpload(buf, mimetype='application/json', chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        drive_service.files().create(body={'name': f"{sheet}.json", 'parents': [db_id]}, media_body=media, fields='id').execute()
+
+async def process_sheet(executor, sheet, query_id, db, db_id, sf_session, drive_service, gemini_model, project_name):
+    """Runs Task 2 on `executor` and awaits Task 3 for one sheet.
+
+    Progress is collected in `log` so each sheet's lines stay together when
+    the caller writes them. A Task 2 failure is returned as `error` rather than
+    raised, so sibling sheets still get logged and audited.
+    """
+    log = [f"{INDENT}🔵 **Task 2:** Extracting `{sheet}`..."]
+    if not query_id:
+        return {"sheet": sheet, "log": log, "done": False}
+
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(executor, extract_and_upload, sheet, query_id, db, db_id, sf_session, drive_service)
+    except Exception as e:
+        log.append(f"{INDENT}❌ **Task 2 Failed:** `{sheet}` — {e}")
+        return {"sheet": sheet, "log": log, "done": False, "error": e}
+    log.append(f"{INDENT}✅ **Task 2 Success:** `{sheet}` uploaded.")
+
+    # TASK 3: TESTER (GEMINI SENSOR)
+    log.append(f"{INDENT}🔵 **Task 3:** Verification for `{sheet}`")
+    path_ctx = f"{project_name} > {db['dashboard_name']}"
+    ok, msg = await gemini_sensor_with_retry(gemini_model, sheet, path_ctx, log)
+    if ok: log.append(f"{INDENT}✅ **Task 3 Success:** {msg}")
+    else: log.append(f"{INDENT}❌ **Task 3 Failed:** {msg}")
+    return {"sheet": sheet, "log": log, "done": True, "verified": ok}
+
+async def run_sheet_tasks(executor, sheets, qid_map, db, db_id, sf_session, drive_service, gemini_model, project_name):
+    """Runs every sheet of one dashboard concurrently and returns their results in order."""
+    tasks = [
+        process_sheet(executor, sheet, qid_map.get(sheet), db, db_id, sf_session, drive_service, gemini_model, project_name)
+        for sheet in sheets
+    ]
+    return await asyncio.gather(*tasks)
+
+# --- TASK LOG & PREVIEW RENDERING ---
+INDENT = "&nbsp;" * 4      # Task lines under a dashboard
+SUB_INDENT = "&nbsp;" * 6  # Retry attempts under a task
+
+def render_workbook_tasks(wb):
+    """Builds one workbook's DAG preview as a single markdown string."""
+    blocks = []
+    for db in wb.get('dashboards', []):
+        lines = [
+            f"### Dashboard Task Group: {db['dashboard_name']}",
+            f"⚪ **Task 1: Folder Sensor** — Verify `{db['dashboard_name']}` path"
+        ]
+        lines += [f"{INDENT}⚪ **Task 2: Extract & Mask** — Snowflake tag `{sheet}`" for sheet in db.get('sheets', [])]
+        lines.append(f"{INDENT}⚪ **Task 3: Gemini Sensor** — Verify sync for `{db['dashboard_name']}`")
+        blocks.append("  \n".join(lines))
+    return "\n\n".join(blocks)
+
+# --- 4. UI LAYOUT ---
 st.set_page_config(layout="wide", page_title="Airflow BI Orchestrator")
 st.title("🚜 Airflow BI Orchestrator")
 
-if 'gov_logs' not in st.session_state: st.session_state.gov_logs = []
 if 'config' not in st.session_state: st.session_state.config = None
 
 with st.sidebar:
@@ -75,26 +281,28 @@ with st.sidebar:
     config_file = st.file_uploader("Upload DAG JSON (Hierarchy)", type="json")
     cred_file = st.file_uploader("Upload Credentials JSON (Secrets)", type="json")
     
+    # Only re-parse the DAG JSON when the uploaded bytes actually change
     if config_file:
-        config_file.seek(0)
-        st.session_state.config = json.load(config_file)
+        raw = config_file.getvalue()
+        config_hash = hashlib.blake2b(raw, digest_size=8).digest()
+        if st.session_state.get('config_hash') != config_hash:
+            st.session_state.config = json.loads(raw)
+            st.session_state.config_hash = config_hash
 
-# --- 4. DAG PREVIEW (BEFORE EXECUTION) ---
+# --- 5. DAG PREVIEW (BEFORE EXECUTION) ---
 if st.session_state.config:
     st.header(f"⚙️ DAG Preview: {st.session_state.config['project_name']}")
     
-    for wb in st.session_state.config.get('workbooks', []):
-        with st.expander(f"📘 Workbook: {wb['workbook_name']}", expanded=True):
-            for db in wb.get('dashboards', []):
-                st.subheader(f"Dashboard Task Group: {db['dashboard_name']}")
-                st.write(f"⚪ **Task 1: Folder Sensor** — Verify `{db['dashboard_name']}` path")
-                for sheet in db.get('sheets', []):
-                    st.write(f"&nbsp;&nbsp;&nbsp;&nbsp;⚪ **Task 2: Extract & Mask** — Snowflake tag `{sheet}`")
-                st.write(f"&nbsp;&nbsp;&nbsp;&nbsp;⚪ **Task 3: Gemini Sensor** — Verify sync for `{db['dashboard_name']}`")
+    # Task lists are only built once their toggle is switched on
+    for i, wb in enumerate(st.session_state.config.get('workbooks', [])):
+        with st.expander(f"📘 Workbook: {wb['workbook_name']}", expanded=False):
+            st.caption(f"{len(wb.get('dashboards', []))} dashboard task group(s)")
+            if st.toggle("Show tasks", key=f"toggle_{i}_{wb['workbook_name']}"):
+                st.markdown(render_workbook_tasks(wb))
     
     st.divider()
 
-    # --- 5. EXECUTION ---
+    # --- 6. EXECUTION ---
     if st.button("▶️ TRIGGER DAG", type="primary"):
         if not cred_file:
             st.error("Please upload your Credentials JSON first.")
@@ -110,43 +318,52 @@ if st.session_state.config:
                     if not (sf_session and drive_service and gemini_model):
                         st.stop()
 
-                    # Phase 1: Hierarchy Setup
-                    p_id, p_msg = get_or_create_folder(drive_service, st.session_state.config['project_name'])
-                    st.write(f"📁 **Project Check:** `{st.session_state.config['project_name']}` — {p_msg}")
+                    # Phase 1: Hierarchy Setup (one batched Drive round-trip per tree level)
+                    project_name = st.session_state.config['project_name']
+                    workbooks = st.session_state.config.get('workbooks', [])
+                    folder_cache = {}  # {(parent_id, name): folder_id} for this run
+                    p_id, p_msg = get_or_create_folder(drive_service, project_name, folder_cache=folder_cache)
+                    st.write(f"📁 **Project Check:** `{project_name}` — {p_msg}")
+                    wb_folders = get_or_create_folders(drive_service, [(p_id, wb['workbook_name']) for wb in workbooks], folder_cache)
+                    db_folders = get_or_create_folders(drive_service, [
+                        (wb_folders[(p_id, wb['workbook_name'])][0], db['dashboard_name'])
+                        for wb in workbooks for db in wb.get('dashboards', [])
+                    ], folder_cache)
 
-                    for wb in st.session_state.config.get('workbooks', []):
-                        wb_id, w_msg = get_or_create_folder(drive_service, wb['workbook_name'], p_id)
+                    # Worker threads (and their Drive connections) live for the whole run
+                    with ThreadPoolExecutor(max_workers=DAG_MAX_WORKERS) as executor:
+                        for wb in workbooks:
+                            wb_id, w_msg = wb_folders[(p_id, wb['workbook_name'])]
                         
-                        for db in wb.get('dashboards', []):
-                            # TASK 1: FOLDER SENSOR
-                            db_id, d_msg = get_or_create_folder(drive_service, db['dashboard_name'], wb_id)
-                            st.write(f"✅ **Task 1:** Dashboard folder `{db['dashboard_name']}` — {d_msg}")
-
-                            # TASK 2: OPERATOR (EXTRACT/MASK)
-                            for sheet in db.get('sheets', []):
-                                st.write(f"&nbsp;&nbsp;&nbsp;&nbsp;🔵 **Task 2:** Extracting `{sheet}`...")
-                                q_id = sf_session.sql(f"SELECT QUERY_ID FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY()) WHERE QUERY_TAG = '{sheet}' AND EXECUTION_STATUS = 'SUCCESS' ORDER BY START_TIME DESC LIMIT 1").collect()
-                                
-                                if q_id:
-                                    df = sf_session.sql(f"SELECT * FROM TABLE(RESULT_SCAN('{q_id[0][0]}'))").to_pandas()
-                                    # Masking
-                                    for col in db.get('mask_columns', []):
-                                        if col in df.columns: df[col] = "***"
-                                    
-                                    # Export
-                                    output = df.to_json(orient='records', indent=2)
-                                    media = MediaIoBaseUpload(io.BytesIO(output.encode()), mimetype='application/json')
-                                    drive_service.files().create(body={'name': f"{sheet}.json", 'parents': [db_id]}, media_body=media).execute()
-                                    st.write(f"&nbsp;&nbsp;&nbsp;&nbsp;✅ **Task 2 Success:** `{sheet}` uploaded.")
-
-                                    # TASK 3: TESTER (GEMINI SENSOR)
-                                    st.write(f"&nbsp;&nbsp;&nbsp;&nbsp;🔵 **Task 3:** Verification for `{sheet}`")
-                                    path_ctx = f"{st.session_state.config['project_name']} > {db['dashboard_name']}"
-                                    ok, msg = gemini_sensor_with_retry(gemini_model, sheet, path_ctx)
-                                    if ok: st.write(f"&nbsp;&nbsp;&nbsp;&nbsp;✅ **Task 3 Success:** {msg}")
-                                    else: st.write(f"&nbsp;&nbsp;&nbsp;&nbsp;❌ **Task 3 Failed:** {msg}")
-                                    
-                                    st.session_state.gov_logs.append({"Task": sheet, "Status": "Complete", "Gemini": "Verified"})
+                            for db in wb.get('dashboards', []):
+                                # TASK 1: FOLDER SENSOR
+                                db_id, d_msg = db_folders[(wb_id, db['dashboard_name'])]
+                                st.write(f"✅ **Task 1:** Dashboard folder `{db['dashboard_name']}` — {d_msg}")
+
+                                # TASK 2 + 3: fan the sheets out concurrently
+                                sheets = db.get('sheets', [])
+                                qid_map = latest_query_ids(sf_session, sheets)
+                                results = asyncio.run(run_sheet_tasks(
+                                    executor, sheets, qid_map, db, db_id, sf_session, drive_service, gemini_model, project_name
+                                ))
+                                gov_records = []
+                                for result in results:
+                                    for line in result['log']: st.write(line)
+                                    if result['done']:
+                                        gov_records.append({
+                                            "Project": project_name,
+                                            "Workbook": wb['workbook_name'],
+                                            "Dashboard": db['dashboard_name'],
+                                            "Sheet_Tag": result['sheet'],
+                                            "Masked_Cols": ", ".join(db.get('mask_columns', [])) or "NONE",
+                                            "Status": "Complete",
+                                            "Gemini": "Verified" if result['verified'] else "Failed"
+                                        })
+                                append_gov_logs(gov_records)
+
+                                # Surface the first sheet failure only after its siblings are recorded
+                                errors = [r['error'] for r in results if r.get('error')]
+                                if errors: raise errors[0]
                 
                     status.update(label="DAG Execution Finished", state="complete")
                     st.balloons()
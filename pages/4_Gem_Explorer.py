@@ -1,12 +1,18 @@
 import streamlit as st
 import pandas as pd
+import json
+import polars as pl
+from governance_log import GOV_LOG_DIR
 from datetime import datetime
 
 # --- MOCK GEMINI TECHNICAL METADATA ---
-def get_gemini_index_metadata(config):
+@st.cache_data(ttl=600)
+def get_gemini_index_metadata(config_json):
     """
     Simulates fetching the current state of the Gemini Vector Index.
+    Cached on the config JSON so widget reruns skip the rebuild.
     """
+    config = json.loads(config_json)
     metadata = []
     for wb in config.get('workbooks', []):
         for db in wb.get('dashboards', []):
@@ -22,6 +28,55 @@ def get_gemini_index_metadata(config):
             })
     return pd.DataFrame(metadata)
 
+@st.cache_data(ttl=600)
+def build_db_index(config_json):
+    """
+    Maps each dashboard name to its config (first occurrence wins).
+    Key order doubles as the unique dashboard list for the selectbox.
+    """
+    config = json.loads(config_json)
+    index = {}
+    for wb in config.get('workbooks', []):
+        for db in wb.get('dashboards', []):
+            index.setdefault(db['dashboard_name'], db)
+    return index
+
+@st.cache_data(ttl=60)
+def load_knowledge_hierarchy(project_name, config_json):
+    """
+    Aggregates the persisted DAG logs for one project (short TTL picks up new runs).
+    Masking policy comes from the current config, falling back to the logged value.
+    """
+    config = json.loads(config_json)
+    policies = pl.LazyFrame(
+        [
+            {"Workbook": wb['workbook_name'], "Dashboard": db['dashboard_name'],
+             "Masked_PII": ", ".join(db.get('mask_columns', [])) or "NONE"}
+            for wb in config.get('workbooks', []) for db in wb.get('dashboards', [])
+        ],
+        schema={"Workbook": pl.String, "Dashboard": pl.String, "Masked_PII": pl.String}
+    ).unique(subset=['Workbook', 'Dashboard'], keep='first')
+    return (
+        pl.scan_parquet(
+            f"{GOV_LOG_DIR}/**/*.parquet", hive_partitioning=True,
+            hive_schema={'Project': pl.String, 'Workbook': pl.String}
+        )
+        .filter(pl.col('Project') == project_name)
+        .group_by(['Project', 'Workbook', 'Dashboard'])
+        .agg(
+            pl.col('Sheet_Tag').n_unique().alias('Total_Files'),
+            pl.col('Masked_Cols').last().alias('Logged_PII')
+        )
+        .join(policies, on=['Workbook', 'Dashboard'], how='left')
+        .select(
+            'Project', 'Workbook', 'Dashboard', 'Total_Files',
+            pl.coalesce('Masked_PII', 'Logged_PII').alias('Masked_PII')
+        )
+        .sort(['Workbook', 'Dashboard'])
+        .collect()
+        .to_pandas()
+    )
+
 # --- UI LOGIC ---
 st.set_page_config(layout="wide")
 st.title("💎 Gemini Knowledge Health")
@@ -30,24 +85,21 @@ st.markdown("Monitor the live context and security boundaries of your Gemini Kno
 # Ensure config is available
 if 'config' in st.session_state and st.session_state.config:
     config = st.session_state.config
+    config_json = json.dumps(config, sort_keys=True)
+    db_index = build_db_index(config_json)
     
     # 1. Technical Health Overview
     st.subheader("🧠 Gemini Index Status")
-    df_meta = get_gemini_index_metadata(config)
+    df_meta = get_gemini_index_metadata(config_json)
     st.dataframe(df_meta, use_container_width=True, hide_index=True)
 
     # 2. Knowledge Hierarchy (Dynamic Tree)
     st.divider()
     st.write("### 🏗️ Knowledge Hierarchy")
     
-    # We use session logs if they exist, otherwise we mock the current tree
-    if 'gov_logs' in st.session_state and st.session_state.gov_logs:
-        df = pd.DataFrame(st.session_state.gov_logs)
-        hierarchy = df.groupby(['Project', 'Workbook', 'Dashboard']).agg({
-            'Sheet_Tag': 'count', 
-            'Masked_Cols': 'first'
-        }).reset_index()
-        hierarchy.columns = ['Project', 'Workbook', 'Dashboard', 'Total_Files', 'Masked_PII']
+    # We use the persisted DAG logs for this project if they exist, otherwise we mock the current tree
+    hierarchy = load_knowledge_hierarchy(config['project_name'], config_json) if GOV_LOG_DIR.is_dir() else None
+    if hierarchy is not None and not hierarchy.empty:
         st.dataframe(hierarchy, use_container_width=True, hide_index=True)
     else:
         st.info("No live logs found. Displaying planned hierarchy from JSON.")
@@ -56,10 +108,10 @@ if 'config' in st.session_state and st.session_state.config:
     st.divider()
     st.subheader("📝 Live Gem Instruction Preview")
     
-    selected_db = st.selectbox("Choose a Dashboard to see its AI System Prompt:", df_meta['Dashboard Context'].unique())
+    selected_db = st.selectbox("Choose a Dashboard to see its AI System Prompt:", list(db_index))
     
     # Extract specific config for the selected dashboard
-    db_details = next(db for wb in config['workbooks'] for db in wb['dashboards'] if db['dashboard_name'] == selected_db)
+    db_details = db_index[selected_db]
     gem_cfg = db_details.get('gem_config', {})
     
     prompt = f"""